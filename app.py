@@ -1,34 +1,41 @@
 import streamlit as st
 import os
-from resolution_reviewer import ResolutionReviewer
+
+# Persist tiktoken's BPE vocab on disk so fresh processes skip re-downloading it.
+os.environ.setdefault("TIKTOKEN_CACHE_DIR", os.path.join(os.getcwd(), ".tiktoken_cache"))
+os.makedirs(os.environ["TIKTOKEN_CACHE_DIR"], exist_ok=True)
+
+from resolution_reviewer import ResolutionReviewer, content_hash
+
+@st.cache_resource
+def get_reviewer(api_key):
+    return ResolutionReviewer(api_key)
+
+@st.cache_data(ttl=86400, max_entries=256)
+def _cached_review(_reviewer, text_hash, _text, _usage):
+    # Only text_hash is hashed by Streamlit; the reviewer and raw text are passed through.
+    # Usage is handed back through _usage and kept out of the cached value, so it
+    # is only filled in when this call actually ran.
+    results = _reviewer.review_resolution(text=_text)
+    _usage.update(results.get("_usage", {}))
+    return {key: value for key, value in results.items() if key != "_usage"}
 
 def select_or_upload_file(res_dir):
     st.subheader("Upload a Resolution Document")
-    uploaded_file = st.file_uploader("Upload a .docx file:", type=['docx'])
-    temp_file_path = None
-    file_to_review = None
-    file_source = None
-    if uploaded_file is not None:
-        temp_file_path = "temp_resolution.docx"
-        with open(temp_file_path, "wb") as f:
-            f.write(uploaded_file.getvalue())
-        file_to_review = temp_file_path
-        file_source = "uploaded"
-    return file_to_review, file_source, temp_file_path
+    # The upload is read in memory; nothing is written to disk, so concurrent
+    # sessions cannot clobber each other's files.
+    return st.file_uploader("Upload a .docx file:", type=['docx'])
 
-def show_document_preview(reviewer, file_to_review):
+def show_document_preview(extracted_text):
     with st.expander("Preview Extracted Text from Document", expanded=False):
-        try:
-            extracted_text = reviewer.read_document(file_to_review)
-            st.text_area("Extracted Text", extracted_text, height=300)
-        except Exception as e:
-            st.error(f"Could not extract text: {e}")
+        st.text_area("Extracted Text", extracted_text, height=300)
 
-def analyze_and_display_results(reviewer, file_to_review, file_source, temp_file_path):
+def analyze_and_display_results(reviewer, extracted_text):
     if st.button("Analyze Resolution", type="primary"):
         try:
             with st.spinner("Analyzing resolution..."):
-                results = reviewer.review_resolution(file_to_review)
+                usage = {}
+                results = _cached_review(reviewer, content_hash(extracted_text), extracted_text, usage)
             st.header("Review Results")
             col1, col2 = st.columns(2)
             with col1:
@@ -53,11 +60,15 @@ def analyze_and_display_results(reviewer, file_to_review, file_source, temp_file
                     st.success("No formatting violations found.")
             st.subheader("Overall Assessment")
             st.info(results["overall_assessment"])
+            if usage:
+                st.caption(
+                    f"Tokens: {usage['prompt_tokens']} prompt ({usage['cached_tokens']} cached), "
+                    f"{usage['completion_tokens']} completion"
+                )
+            else:
+                st.caption("Cached result; no tokens used.")
         except Exception as e:
             st.error(f"An error occurred: {str(e)}")
-        finally:
-            if file_source == "uploaded" and os.path.exists(temp_file_path):
-                os.remove(temp_file_path)
 
 def main():
     st.set_page_config(
@@ -74,11 +85,16 @@ This tool analyzes CUNY Board of Trustees resolutions for compliance with templa
         st.error("Please set the OPENAI_API_KEY environment variable.")
         st.stop()
     res_dir = os.path.join(os.getcwd(), "reinaccurateboardresolutions")
-    file_to_review, file_source, temp_file_path = select_or_upload_file(res_dir)
-    if file_to_review:
-        reviewer = ResolutionReviewer(OPENAI_API_KEY)
-        show_document_preview(reviewer, file_to_review)
-        analyze_and_display_results(reviewer, file_to_review, file_source, temp_file_path)
+    file_to_review = select_or_upload_file(res_dir)
+    if file_to_review is not None:
+        reviewer = get_reviewer(OPENAI_API_KEY)
+        try:
+            extracted_text = reviewer.read_document(file_to_review)
+        except Exception as e:
+            st.error(f"Could not extract text: {e}")
+            st.stop()
+        show_document_preview(extracted_text)
+        analyze_and_display_results(reviewer, extracted_text)
     else:
         st.info("Please upload a .docx file to begin.")
 
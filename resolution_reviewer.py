@@ -1,230 +1,630 @@
 import os
-import json
+import logging
+import asyncio
+import time
+import zipfile
+import functools
+import hashlib
+import threading
+import re
+import tempfile
+import orjson
 from docx import Document
-from openai import OpenAI
-from typing import Dict
+from lxml import etree
+from collections import OrderedDict
+from openai import OpenAI, AsyncOpenAI
+from typing import BinaryIO, Dict, Final, List, Optional, Union
 import tiktoken
 
+logger = logging.getLogger(__name__)
+
+_MODEL = "gpt-4.1-mini-2025-04-14"
+# The violation JSON normally fits well under the first cap; the second is
+# only used to retry a response that was cut off.
+_MAX_TOKENS = 1500
+_RETRY_MAX_TOKENS = 4000
+
+_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "res-bot")
+
+@functools.lru_cache(maxsize=4)
+def _get_encoder(model: str):
+    return tiktoken.encoding_for_model(model)
+
 def count_tokens(text: str) -> int:
-    encoding = tiktoken.encoding_for_model("gpt-4")
-    return len(encoding.encode(text))
+    return len(_get_encoder("gpt-4").encode(text))
+
+_W = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+
+def _run_text(run) -> str:
+    # Same mapping as python-docx's Run.text: only direct children of the run count.
+    parts = []
+    for child in run:
+        if child.tag == _W + "t":
+            parts.append(child.text or "")
+        elif child.tag in (_W + "tab", _W + "ptab"):
+            parts.append("\t")
+        elif child.tag == _W + "br":
+            if child.get(_W + "type", "textWrapping") == "textWrapping":
+                parts.append("\n")
+        elif child.tag == _W + "cr":
+            parts.append("\n")
+        elif child.tag == _W + "noBreakHyphen":
+            parts.append("-")
+    return "".join(parts)
+
+def _extract_docx_text(source: Union[str, BinaryIO]) -> str:
+    # Walk word/document.xml directly instead of building python-docx's
+    # Paragraph/Run objects. Like Document.paragraphs, only paragraphs directly
+    # under w:body are read, so table cells and text boxes are skipped, and
+    # consumed elements are dropped from the tree to keep memory flat.
+    paragraphs = []
+    with zipfile.ZipFile(source) as archive, archive.open("word/document.xml") as stream:
+        # Uploads are untrusted: never expand entities or fetch anything, as python-docx's parser does.
+        for _, elem in etree.iterparse(stream, tag=_W + "p", resolve_entities=False, no_network=True):
+            parent = elem.getparent()
+            if parent is None or parent.tag != _W + "body":
+                continue
+            parts = []
+            for child in elem:
+                if child.tag == _W + "r":
+                    parts.append(_run_text(child))
+                elif child.tag == _W + "hyperlink":
+                    parts.extend(_run_text(run) for run in child.iterchildren(_W + "r"))
+            paragraphs.append("".join(parts))
+            elem.clear()
+            while elem.getprevious() is not None:
+                del parent[0]
+    return "\n".join(paragraphs)
+
+def _docx_text(source: Union[str, BinaryIO]) -> str:
+    try:
+        return _extract_docx_text(source)
+    except (KeyError, zipfile.BadZipFile, etree.XMLSyntaxError):
+        if not isinstance(source, str):
+            source.seek(0)
+        doc = Document(source)
+        return "\n".join([paragraph.text for paragraph in doc.paragraphs])
+
+@functools.lru_cache(maxsize=32)
+def _read_docx(file_path: str, mtime: float) -> str:
+    # mtime is part of the cache key so an overwritten file is re-parsed.
+    return _docx_text(file_path)
+
+# Extracted text of in-memory uploads keyed by a content digest, so the same
+# upload is a cache hit across reruns without keeping the upload bytes alive.
+_UPLOAD_TEXT_CACHE: "OrderedDict[str, str]" = OrderedDict()
+_UPLOAD_TEXT_CACHE_SIZE = 32
+_UPLOAD_TEXT_CACHE_LOCK = threading.Lock()
+
+def _read_docx_upload(source: BinaryIO) -> str:
+    source.seek(0)
+    digest = hashlib.blake2b(digest_size=16)
+    for chunk in iter(lambda: source.read(64 * 1024), b""):
+        digest.update(chunk)
+    key = digest.hexdigest()
+    with _UPLOAD_TEXT_CACHE_LOCK:
+        if key in _UPLOAD_TEXT_CACHE:
+            _UPLOAD_TEXT_CACHE.move_to_end(key)
+            return _UPLOAD_TEXT_CACHE[key]
+    source.seek(0)
+    text = _docx_text(source)
+    with _UPLOAD_TEXT_CACHE_LOCK:
+        _UPLOAD_TEXT_CACHE[key] = text
+        _UPLOAD_TEXT_CACHE.move_to_end(key)
+        while len(_UPLOAD_TEXT_CACHE) > _UPLOAD_TEXT_CACHE_SIZE:
+            _UPLOAD_TEXT_CACHE.popitem(last=False)
+    return text
+
+# The system prompt is assembled from these parts so that per-section reviews
+# can send only the rules relevant to the section they are checking.
+_PROMPT_INTRO: Final[str] = """You review CUNY Board of Trustees resolutions for compliance with the template and rules below.
+For each violation give: the rule, the location (line, or WHEREAS clause number and the point it misses), the problem, and a fix.
 
-class ResolutionReviewer:
-    def __init__(self, api_key: str):
-        self.client = OpenAI(api_key=api_key)
-        self.system_prompt = self._get_system_prompt()
-
-    def _get_system_prompt(self) -> str:
-        return """You are an expert reviewer of CUNY Board of Trustees resolutions. Your task is to analyze resolutions for compliance with the template and rules below.
-
-For each violation found, you must:
-1. Identify the specific rule or template requirement that was violated
-2. Explain the error clearly
-3. Provide the exact line where the error occurs. If a WHEREAS clause doesn't address a specific point that it is supposed to, then provide the number of that clause.
-4. Suggest how to fix it
-
-TEMPLATE STRUCTURE:
-1. The resolution must follow this exact structure:
-   - First line: "Board of Trustees of The City University of New York"
-   - Next line: "RESOLUTION TO"
-   - Next line: "Establish a [Degree Level Program] in [Subject] at [College Name]"
-   - Next line: [Date of Board of Trustees' committee meeting]. Date must be in format "Month DD, YYYY"
-   - WHEREAS clauses
-   - 'NOW THEREFORE BE IT'
-   - RESOLVED clause
-   - EXPLANATION part
-
-2. WHEREAS Clauses Requirements:
-   - Each WHEREAS clause, must address specific points, individually and in order:
-     1. Why the CUNY and market needs this program
-     2. How the program curriculum and credits are designed to meet the needs of the CUNY and market
-     3. Current student interest in the program
-     4. Transferability of the program courses
-     5. Benefits to students served and benefits to the CUNY and market
-     6. Projected enrollment, retention, and graduation in the first 3 to 5 years
-     7. Financial sustainability of the program given demand, section size, and current staffing, and projected revenue through enrollment to cover all operating costs in the first year
-     8. Program investments during the initial growth period; include any space/equipment needs, renovations, staff and faculty hiring (list number of Part and Full Time Faculty), as indicated, and identify the sources of funds for each.
-   - If a clause doesn't address a specific point that it is supposed to in a clear manner, then it is a violation and you must provide the number of that clause, and the specific point it doesn't address, along with the suggested fix.
-   - All the specific points must be addressed in a clear and concise manner. If not, then it is a violation and you must provide the point that is missing, and suggest/write a WHEREAS clause that addresses it.
-   - Each clause must end with "; and" except the last one which ends with a period
-   - Each clause must be a single statement without any full-stops. Internal periods, like commas, are allowed.
-
-3. RESOLVED Clause Requirements:
-   - The RESOLVED clause must state the aim of the resolution succinctly
-   - The RESOLVED clause must be a single statement with only 1 full-stop. Internal periods, like commas, are allowed.
-
-4. EXPLANATION Requirements:
-   - The EXPLANATION part must briefly summarize the purpose and benefits of the resolution.
-
-5. Resolution Structure Rules:
-   - Must include "NOW, THEREFORE, BE IT" after the last WHEREAS clause
-   - Must have exactly one RESOLVED clause
-   - Must include EXPLANATION section after RESOLVED clause
-
-FORMATTING RULES:
-1. Clause Formatting:
-   - WHEREAS clauses must start with "WHEREAS,"
-   - Only one full-stop allowed across all WHEREAS clause (except the last WHEREAS clause)
-   - "; and" required at end of all WHEREAS clauses except the last
-   - RESOLVED clause must start with "RESOLVED,"
-   - RESOLVED clause must come after "NOW, THEREFORE, BE IT"
-   - EXPLANATION part must start with "EXPLANATION:"
-   - EXPLANATION must come after RESOLVED clause
-
-Provide your analysis in the following JSON format:
-{
-    "template_violations": [
-        {
-            "rule": "string - the specific rule violated",
-            "location": "string - where in the document" OR "#clause that violates a rule - the number of the clause violated - the specific point it doesn't address",
-            "description": "string - clear explanation of the violation",
-            "suggestion": "string - how to fix it"
-        }
-    ],
-    "formatting_violations": [
-        {
-            "rule": "string - the specific rule violated",
-            "location": "string - where in the document",
-            "description": "string - clear explanation of the violation",
-            "suggestion": "string - how to fix it"
-        }
-    ],
-    "overall_assessment": "string - brief summary of the resolution's compliance"
-}
 """
 
-    def read_document(self, file_path: str) -> str:
-        doc = Document(file_path)
-        return "\n".join([paragraph.text for paragraph in doc.paragraphs])
+_TEMPLATE_RULES: Final[str] = """## Template (in order)
+1. "Board of Trustees of The City University of New York"
+2. "RESOLUTION TO"
+3. "Establish a [Degree Level Program] in [Subject] at [College Name]"
+4. Committee meeting date as "Month DD, YYYY"
+5. WHEREAS clauses
+6. "NOW, THEREFORE, BE IT"
+7. Exactly one RESOLVED clause
+8. EXPLANATION
 
-    def review_resolution(self, file_path: str) -> Dict:
-        resolution_text = self.read_document(file_path)
-        ex_original, ex_modified, changes = self._get_examples()
-        user_prompt = self._build_user_prompt(ex_original, ex_modified, changes, resolution_text)
-        system_tokens = count_tokens(self.system_prompt)
-        user_tokens = count_tokens(user_prompt)
-        total_tokens = system_tokens + user_tokens
-        response = self.client.chat.completions.create(
-            model="gpt-4.1-mini-2025-04-14",
-            messages=[
-                {"role": "system", "content": self.system_prompt},
-                {"role": "user", "content": user_prompt}
-            ],
-            response_format={ "type": "json_object" }
-        )
-        print("DEBUG: response.choices[0].message.content =", repr(response.choices[0].message.content))
-        return json.loads(response.choices[0].message.content)
+"""
 
-    def _get_examples(self):
-        ex_original = """
-        Board of Trustees of the City University of New York
+_WHEREAS_RULES: Final[str] = """## WHEREAS points (one clause each, in order)
+1. Why CUNY and the market need the program
+2. How curriculum and credits meet those needs
+3. Current student interest
+4. Transferability of courses
+5. Benefits to students, CUNY and the market
+6. Projected enrollment, retention and graduation, years 1-5
+7. Financial sustainability: demand, section size, staffing, first-year revenue covering operating costs
+8. Initial investments: space/equipment, renovations, staff and faculty hiring (number of part- and full-time faculty), and funding source for each
+A clause that misses its point is a template violation: cite the clause number and point. A missing point is a template violation: suggest a WHEREAS clause for it.
 
-        RESOLUTION TO
+"""
 
-        Establish a Bachelor of Arts in Data Analytics at Brooklyn College
+_WHEREAS_FORMAT: Final[str] = '- WHEREAS clauses start with "WHEREAS,", are single statements with no full-stops, and end with "; and" except the last, which ends with a period\n'
+_RESOLVED_FORMAT: Final[str] = '- RESOLVED starts with "RESOLVED,", follows "NOW, THEREFORE, BE IT", states the aim succinctly, one sentence\n'
+_EXPLANATION_FORMAT: Final[str] = '- EXPLANATION starts with "EXPLANATION:", follows RESOLVED, briefly summarizes purpose and benefits\n'
+
+# The JSON shape itself is enforced by _REVIEW_SCHEMA through response_format.
+_OUTPUT_RULES: Final[str] = "\nList template and formatting violations separately, then give a brief overall assessment.\n"
+
+_SYSTEM_PROMPT: Final[str] = (
+    _PROMPT_INTRO + _TEMPLATE_RULES + _WHEREAS_RULES
+    + "## Formatting\n" + _WHEREAS_FORMAT + _RESOLVED_FORMAT + _EXPLANATION_FORMAT
+    + _OUTPUT_RULES
+)
+
+_SECTION_PROMPTS: Final[Dict[str, str]] = {
+    "header": (
+        _PROMPT_INTRO
+        + "You are given only the header, the text before the first WHEREAS clause. Check it against template lines 1-4.\n\n"
+        + _TEMPLATE_RULES + _OUTPUT_RULES
+    ),
+    "whereas": (
+        _PROMPT_INTRO
+        + "You are given only the WHEREAS clauses.\n\n"
+        + _WHEREAS_RULES + "## Formatting\n" + _WHEREAS_FORMAT + _OUTPUT_RULES
+    ),
+    "resolved": (
+        _PROMPT_INTRO
+        + 'You are given only the text from "NOW, THEREFORE, BE IT" up to the EXPLANATION. It must contain exactly one RESOLVED clause.\n\n'
+        + "## Formatting\n" + _RESOLVED_FORMAT + _OUTPUT_RULES
+    ),
+    "explanation": (
+        _PROMPT_INTRO
+        + "You are given only the EXPLANATION.\n\n"
+        + "## Formatting\n" + _EXPLANATION_FORMAT + _OUTPUT_RULES
+    )
+}
 
-        February 28, 2025
+_SECTION_TITLES: Final[Dict[str, str]] = {
+    "header": "Header",
+    "whereas": "WHEREAS clauses",
+    "resolved": "RESOLVED clause",
+    "explanation": "EXPLANATION"
+}
 
-        WHEREAS, Knowledge of data practices, ranging from programming to statistics to data story-telling and visualization, is in high demand in the contemporary labor market, according to the US Department of Labor, with expected growth in New York State between 10% and 43% over the next ten years; and
+# Start of every section after the header, in the order the template requires.
+_SECTION_ANCHORS: Final[List] = [
+    ("whereas", re.compile(r"^\s*WHEREAS,", re.MULTILINE)),
+    ("resolved", re.compile(r"^\s*NOW,?\s*THEREFORE", re.MULTILINE)),
+    ("explanation", re.compile(r"^\s*EXPLANATION:", re.MULTILINE))
+]
 
-        WHEREAS, The typical approach to undergraduate programs in the field (including data analytics in various forms as well as data science) has tended to stress technical skills. Much less attention has been paid in undergraduate programs to a broad perspective—data practices in society, or the "data landscape"—and the integration of data skills and training in contexts, organizations, and communities; and
+# Default cap on chat completion requests in flight at once on the async path.
+_CONCURRENCY = 8
 
-        WHEREAS, Brooklyn College is proposing the establishment of a Bachelor of Arts ("BA") program in Data Analytics, organized around the idea of data acumen, or the ability to make creative, sound judgments and decisions with data. This approach requires a solid foundation in data skills, such as programming in Python, statistics and probability, and data visualization. But it goes beyond this foundation by bringing to bear deep knowledge of communication and contexts from the social and behavioral sciences, and;
 
-        WHEREAS, The proposed 58- to 72.5-credit Bachelor of Arts program tracks to capture a diverse population of students across the behavioral, natural, and social sciences. The first track is for social and behavioral science or humanities students who are interested in careers in data analytics. Students in this track take statistics and data analysis courses in the department of Management, Marketing, and Entrepreneurship, Economics, Psychology, or Sociology. The second track is intended for STEM students who are interested in more mathematics-oriented careers in data science; and
+_EX_ORIGINAL: Final[str] = """
+Board of Trustees of the City University of New York
 
-        WHEREAS, The proposed Bachelor of Arts program will be housed in the School of Natural and Behavioral Sciences with participation of the Departments of Computer and Informational Science, Mathematics, Economics, Management, Marketing and Entrepreneurship, Psychology, Sociology, and Communication Arts, Sciences and Disorders; and
+RESOLUTION TO
 
-        WHEREAS, Students completing the program will acquire the knowledge and skills necessary for career advancement in areas of data management, data analytics, data visualization, and data communications in a variety of employment settings; and
+Establish a Bachelor of Arts in Data Analytics at Brooklyn College
 
-        WHEREAS, The proposed Bachelor of Arts program has an articulation agreement with the Associate of Science program in data science at Borough of Manhattan Community College. Further, possible connections with other University programs at the undergraduate and graduate levels, as well as programs of the City of New York to promote data careers, ensures a reliable pipeline of students into the professions; and
+February 28, 2025
 
-        WHEREAS, The predicted enrollment and retention of students in the BA in Data Analytics, based on existing student interest as well as substantial and expanding market demand for graduates with this qualification, is expected to generate robust growth. The program will increase revenue while containing costs through the use of existing faculty, curriculum, and college resources; and
+WHEREAS, Knowledge of data practices, ranging from programming to statistics to data story-telling and visualization, is in high demand in the contemporary labor market, according to the US Department of Labor, with expected growth in New York State between 10% and 43% over the next ten years; and
 
-        NOW, THEREFORE, BE IT
+WHEREAS, The typical approach to undergraduate programs in the field (including data analytics in various forms as well as data science) has tended to stress technical skills. Much less attention has been paid in undergraduate programs to a broad perspective—data practices in society, or the "data landscape"—and the integration of data skills and training in contexts, organizations, and communities; and
 
-        RESOLVED, That the Board of Trustees of the City University of New York
-        authorizes the proposed program in Data Analytics leading to the Bachelor of Arts degree at Brooklyn College be presented to the New York State Education Department for their consideration and registration in accordance with any and all regulations of the New York State Department of Education ("NYSED") for their consideration and registration in accordance with any and all of NYSED's regulations, subject to financial ability. 
+WHEREAS, Brooklyn College is proposing the establishment of a Bachelor of Arts ("BA") program in Data Analytics, organized around the idea of data acumen, or the ability to make creative, sound judgments and decisions with data. This approach requires a solid foundation in data skills, such as programming in Python, statistics and probability, and data visualization. But it goes beyond this foundation by bringing to bear deep knowledge of communication and contexts from the social and behavioral sciences, and;
 
-        EXPLANATION: The proposed program will build upon a strong foundation in data analysis and quantitative methods, drawing on existing faculty expertise across three schools at Brooklyn College. It will serve The City University of New York's mission to prepare its diverse population of students for the future of work in data careers. It will allow students to develop the necessary skills for academic and professional advancement in this fast-growing area while ensuring equity and access to this vital professional field.
-        """
-        ex_modified = """
-        Board of Trustees of the City University of New York
+WHEREAS, The proposed 58- to 72.5-credit Bachelor of Arts program tracks to capture a diverse population of students across the behavioral, natural, and social sciences. The first track is for social and behavioral science or humanities students who are interested in careers in data analytics. Students in this track take statistics and data analysis courses in the department of Management, Marketing, and Entrepreneurship, Economics, Psychology, or Sociology. The second track is intended for STEM students who are interested in more mathematics-oriented careers in data science; and
 
-        RESOLUTION TO
+WHEREAS, The proposed Bachelor of Arts program will be housed in the School of Natural and Behavioral Sciences with participation of the Departments of Computer and Informational Science, Mathematics, Economics, Management, Marketing and Entrepreneurship, Psychology, Sociology, and Communication Arts, Sciences and Disorders; and
 
-        Establish a Bachelor of Arts in Data Analytics at Brooklyn College
+WHEREAS, Students completing the program will acquire the knowledge and skills necessary for career advancement in areas of data management, data analytics, data visualization, and data communications in a variety of employment settings; and
 
-        February 28, 2025
+WHEREAS, The proposed Bachelor of Arts program has an articulation agreement with the Associate of Science program in data science at Borough of Manhattan Community College. Further, possible connections with other University programs at the undergraduate and graduate levels, as well as programs of the City of New York to promote data careers, ensures a reliable pipeline of students into the professions; and
 
-        WHEREAS, In the contemporary labor market, knowledge of data practices, everything from programming to statistics to data story-telling and visualization, is in high demand, according to the US Department of Labor, with expected growth in New York State between 10% and 43% over the next ten years; and
+WHEREAS, The predicted enrollment and retention of students in the BA in Data Analytics, based on existing student interest as well as substantial and expanding market demand for graduates with this qualification, is expected to generate robust growth. The program will increase revenue while containing costs through the use of existing faculty, curriculum, and college resources; and
 
-        WHEREAS, The typical approach to undergraduate programs in the field (including data analytics in various forms as well as data science) has tended to stress technical skills with less attention focusing on designing undergraduate programs that take a broad perspective—data practices in society, or the "data landscape"—and the integration of data skills and training in contexts, organizations, and communities; and
+NOW, THEREFORE, BE IT
 
-        WHEREAS, Brooklyn College is proposing the establishment of a Bachelor of Arts ("BA") program in Data Analytics, organized around the idea of data acumen, or the ability to make creative, sound judgments and decisions with data taking an approach requires a solid foundation in data skills, such as programming in Python, statistics and probability, and data visualization but also goes beyond this foundation by bringing to bear deep knowledge of communication and contexts from the social and behavioral sciences, and;
+RESOLVED, That the Board of Trustees of the City University of New York
+authorizes the proposed program in Data Analytics leading to the Bachelor of Arts degree at Brooklyn College be presented to the New York State Education Department for their consideration and registration in accordance with any and all regulations of the New York State Department of Education ("NYSED") for their consideration and registration in accordance with any and all of NYSED's regulations, subject to financial ability. 
 
-        WHEREAS, The proposed 58- to 72.5-credit Bachelor of Arts program provides students with the capability to acquire knowledge and skills necessary for career development in areas of data management, data analytics, data visualization, and data communications in a variety of employment settings make possible though the inclusion of two tracks capturing a diverse population of students with the first track targeting social and behavioral science or humanities students who are interested in careers in data analytics with them completing courses in statistics and data analysis and the second track targeting STEM students who are interested in more mathematics-oriented careers in data science; and
+EXPLANATION: The proposed program will build upon a strong foundation in data analysis and quantitative methods, drawing on existing faculty expertise across three schools at Brooklyn College. It will serve The City University of New York's mission to prepare its diverse population of students for the future of work in data careers. It will allow students to develop the necessary skills for academic and professional advancement in this fast-growing area while ensuring equity and access to this vital professional field.
+"""
 
-        WHEREAS, The proposed Bachelor of Arts program is interdisciplinary being housed in the School of Natural and Behavioral Sciences and in partnership with the Departments of Computer and Informational Science, Mathematics, Economics, Management, Marketing and Entrepreneurship, Psychology, Sociology, and Communication Arts, Sciences and Disorders; and
+_EX_MODIFIED: Final[str] = """
+Board of Trustees of the City University of New York
 
-        WHEREAS, The proposed Bachelor of Arts program has an articulation agreement with the Associate of Science program in data science at Borough of Manhattan Community College with possible connections with other University programs at the undergraduate and graduate levels, as well as programs of the City of New York to promote data careers, ensuring a reliable pipeline of students into the professions; and
+RESOLUTION TO
 
-        WHEREAS, The predicted enrollment and retention of students in the Bachelor of Arts in Data Analytics, based on existing student interest as well as substantial and expanding market demand for graduates with this qualification, is expected to generate robust growth and the program will increase revenue while containing costs through the use of existing faculty, curricula, and college resources.
+Establish a Bachelor of Arts in Data Analytics at Brooklyn College
 
-        NOW, THEREFORE, BE IT
+February 28, 2025
 
-        RESOLVED, That the Board of Trustees of the City University of New York
-        authorizes the proposed program in Data Analytics leading to the Bachelor of Arts degree at Brooklyn College be presented to the New York State Education Department for their consideration and registration in accordance with any and all regulations of the New York State Department of Education ("NYSED") for their consideration and registration in accordance with any and all of NYSED's regulations, subject to financial ability. 
+WHEREAS, In the contemporary labor market, knowledge of data practices, everything from programming to statistics to data story-telling and visualization, is in high demand, according to the US Department of Labor, with expected growth in New York State between 10% and 43% over the next ten years; and
 
-        EXPLANATION: The proposed program will build upon a strong foundation in data analysis and quantitative methods, drawing on existing faculty expertise across three schools at Brooklyn College. It will serve The City University of New York's mission to prepare its diverse population of students for the future of work in data careers as well as help fill the growing market demand for professionals with the skills and background in diverse data practices. It will allow students to develop the necessary skills for academic and professional advancement in this fast-growing area while ensuring equity and access to this vital professional field by targeting students across a range of disciplinary backgrounds from humanities to social sciences to STEM.
-        """
-        changes = """
+WHEREAS, The typical approach to undergraduate programs in the field (including data analytics in various forms as well as data science) has tended to stress technical skills with less attention focusing on designing undergraduate programs that take a broad perspective—data practices in society, or the "data landscape"—and the integration of data skills and training in contexts, organizations, and communities; and
+
+WHEREAS, Brooklyn College is proposing the establishment of a Bachelor of Arts ("BA") program in Data Analytics, organized around the idea of data acumen, or the ability to make creative, sound judgments and decisions with data taking an approach requires a solid foundation in data skills, such as programming in Python, statistics and probability, and data visualization but also goes beyond this foundation by bringing to bear deep knowledge of communication and contexts from the social and behavioral sciences, and;
+
+WHEREAS, The proposed 58- to 72.5-credit Bachelor of Arts program provides students with the capability to acquire knowledge and skills necessary for career development in areas of data management, data analytics, data visualization, and data communications in a variety of employment settings make possible though the inclusion of two tracks capturing a diverse population of students with the first track targeting social and behavioral science or humanities students who are interested in careers in data analytics with them completing courses in statistics and data analysis and the second track targeting STEM students who are interested in more mathematics-oriented careers in data science; and
 
-        In the first 'WHEREAS' clause, the positiong of the phrase 'In the contemporary labor market,' is changed, inserting it first instead of writing it last, removing 'K'. 'everything' is replaced with 'ranging'.
+WHEREAS, The proposed Bachelor of Arts program is interdisciplinary being housed in the School of Natural and Behavioral Sciences and in partnership with the Departments of Computer and Informational Science, Mathematics, Economics, Management, Marketing and Entrepreneurship, Psychology, Sociology, and Communication Arts, Sciences and Disorders; and
 
-        In the second 'WHEREAS' clause, there is a period (full-stop), violating a rule. So 'Much' has been replaced by 'with'. 'has been paid' has been replaced with 'focusing on designing'. 'to a' has been replaced with 'that take a'.
+WHEREAS, The proposed Bachelor of Arts program has an articulation agreement with the Associate of Science program in data science at Borough of Manhattan Community College with possible connections with other University programs at the undergraduate and graduate levels, as well as programs of the City of New York to promote data careers, ensuring a reliable pipeline of students into the professions; and
 
-        In the third 'WHEREAS' clause, there are periods (full-stop), that violates a rule. So 'with data. This' is replaced with 'with data taking an'. 'that' is added for proper sentence structuing. 'data visualization. But it' is replaced with 'data visualization but also'.
+WHEREAS, The predicted enrollment and retention of students in the Bachelor of Arts in Data Analytics, based on existing student interest as well as substantial and expanding market demand for graduates with this qualification, is expected to generate robust growth and the program will increase revenue while containing costs through the use of existing faculty, curricula, and college resources.
 
-        In the fourth 'WHEREAS' clause, there are periods (full-stop), that violates a rule. The paragraph is also formatted properly. The text 'provides students with the capability to acquire knowledge and skills necessary for career development in areas of data management, data analytics, data visualization, and data communications in a variety of employment settings make possible though the inclusion of' is the sixth 'WHEREAS' claues in the original, but is inserted at the beginning of this clause. Multiple grammatical and syntactic changes are also made.
+NOW, THEREFORE, BE IT
+
+RESOLVED, That the Board of Trustees of the City University of New York
+authorizes the proposed program in Data Analytics leading to the Bachelor of Arts degree at Brooklyn College be presented to the New York State Education Department for their consideration and registration in accordance with any and all regulations of the New York State Department of Education ("NYSED") for their consideration and registration in accordance with any and all of NYSED's regulations, subject to financial ability. 
+
+EXPLANATION: The proposed program will build upon a strong foundation in data analysis and quantitative methods, drawing on existing faculty expertise across three schools at Brooklyn College. It will serve The City University of New York's mission to prepare its diverse population of students for the future of work in data careers as well as help fill the growing market demand for professionals with the skills and background in diverse data practices. It will allow students to develop the necessary skills for academic and professional advancement in this fast-growing area while ensuring equity and access to this vital professional field by targeting students across a range of disciplinary backgrounds from humanities to social sciences to STEM.
+"""
 
-        In the fifth 'WHEREAS' clause, certain formatting is done, both grammatical and syntactic.
+_CHANGES: Final[str] = """
 
-        The sixth 'WHEREAS' clause is completely removed, and inserted in the beginning of the fourth 'WHEREAS' clause.
+In the first 'WHEREAS' clause, the positiong of the phrase 'In the contemporary labor market,' is changed, inserting it first instead of writing it last, removing 'K'. 'everything' is replaced with 'ranging'.
 
-        The seventh 'WHEREAS' clause has a period (full-stop) that is dealt with accordingly, keeping the rest of the content same.
+In the second 'WHEREAS' clause, there is a period (full-stop), violating a rule. So 'Much' has been replaced by 'with'. 'has been paid' has been replaced with 'focusing on designing'. 'to a' has been replaced with 'that take a'.
 
-        The eight 'WHEREAS' clause has a period (full-stop) and it ends with '; and' which are violations. Minor grammatical changes are done. Also, the full-form of 'BA' instead of the abbreviation is also done, indicating professionalism of the resolution.
+In the third 'WHEREAS' clause, there are periods (full-stop), that violates a rule. So 'with data. This' is replaced with 'with data taking an'. 'that' is added for proper sentence structuing. 'data visualization. But it' is replaced with 'data visualization but also'.
 
-        The 'NOW, THEREFORE, BE IT' is correct.
+In the fourth 'WHEREAS' clause, there are periods (full-stop), that violates a rule. The paragraph is also formatted properly. The text 'provides students with the capability to acquire knowledge and skills necessary for career development in areas of data management, data analytics, data visualization, and data communications in a variety of employment settings make possible though the inclusion of' is the sixth 'WHEREAS' claues in the original, but is inserted at the beginning of this clause. Multiple grammatical and syntactic changes are also made.
 
-        The 'RESOLVED,' clause is also correct.
+In the fifth 'WHEREAS' clause, certain formatting is done, both grammatical and syntactic.
 
-        In the 'EXPLANATION' part, two sentences are added at the end, which are 'as well as help fill the growing market demand for professionals with the skills and background in diverse data practices' and ' by targeting students across a range of disciplinary backgrounds from humanities to social sciences to STEM'.
-        
-        SUMMARY:- Overall there are multiple modifications needed in the original version, including grammatical and syntactic changes. Certain rules are violated, which are handled accordingly. In general, the original resolution broadly talks in accordance with the template rules and address the points in order.
+The sixth 'WHEREAS' clause is completely removed, and inserted in the beginning of the fourth 'WHEREAS' clause.
+
+The seventh 'WHEREAS' clause has a period (full-stop) that is dealt with accordingly, keeping the rest of the content same.
+
+The eight 'WHEREAS' clause has a period (full-stop) and it ends with '; and' which are violations. Minor grammatical changes are done. Also, the full-form of 'BA' instead of the abbreviation is also done, indicating professionalism of the resolution.
+
+The 'NOW, THEREFORE, BE IT' is correct.
+
+The 'RESOLVED,' clause is also correct.
+
+In the 'EXPLANATION' part, two sentences are added at the end, which are 'as well as help fill the growing market demand for professionals with the skills and background in diverse data practices' and ' by targeting students across a range of disciplinary backgrounds from humanities to social sciences to STEM'.
+
+SUMMARY:- Overall there are multiple modifications needed in the original version, including grammatical and syntactic changes. Certain rules are violated, which are handled accordingly. In general, the original resolution broadly talks in accordance with the template rules and address the points in order.
+"""
+
+# Static few-shot prefix shared by every request. It is assembled once at import
+# and the document text is only ever appended after it, so the bytes stay
+# identical call-to-call and OpenAI's automatic prompt cache can reuse them.
+_USER_PROMPT_PREFIX: Final[str] = f"""Your task is to analyze a draft resolution for compliance with the template and rules.
+An example of a draft resolution is given below, and the suggested corrections.
+The incorrect resolution is given below, followed by the updated version of that resolution.
+The changes that were made and the rules violated are given after the updated version.
+<EXAMPLE START>
+ORIGINAL VERSION:-
+{_EX_ORIGINAL}
+----------------
+MODIFIED VERSION:-
+{_EX_MODIFIED}
+----------------
+ORIGINAL VERSION:-
+{_CHANGES}
+----------------
+<EXAMPLE END>
+
+Based on the template provided, alonside the rules that may or may not be violated, please analyze the following resolution for compliance with the template and rules.
+Provide a detailed analysis identifying any violations of the template or rules.
+
+ANALYZE:
+"""
+
+_VIOLATION_SCHEMA: Final[Dict] = {
+    "type": "object",
+    "properties": {
+        "rule": {"type": "string"},
+        "location": {"type": "string"},
+        "description": {"type": "string"},
+        "suggestion": {"type": "string"}
+    },
+    "required": ["rule", "location", "description", "suggestion"],
+    "additionalProperties": False
+}
+
+_REVIEW_SCHEMA: Final[Dict] = {
+    "type": "object",
+    "properties": {
+        "template_violations": {"type": "array", "items": _VIOLATION_SCHEMA},
+        "formatting_violations": {"type": "array", "items": _VIOLATION_SCHEMA},
+        "overall_assessment": {"type": "string"}
+    },
+    "required": ["template_violations", "formatting_violations", "overall_assessment"],
+    "additionalProperties": False
+}
+
+# Everything other than the document that determines a review, so cached
+# results are invalidated when the model, prompts or schema change.
+_PROMPT_DIGEST = hashlib.blake2b(
+    (_MODEL + _SYSTEM_PROMPT + _USER_PROMPT_PREFIX).encode("utf-8")
+    + orjson.dumps(_SECTION_PROMPTS) + orjson.dumps(_REVIEW_SCHEMA),
+    digest_size=16
+)
+
+def content_hash(text: str, mode: str = "whole") -> str:
+    # mode separates whole-document reviews from merged per-section ones.
+    digest = _PROMPT_DIGEST.copy()
+    digest.update(mode.encode("utf-8") + b"\0")
+    digest.update(text.encode("utf-8"))
+    return digest.hexdigest()
+
+def _split_sections(text: str) -> Dict[str, str]:
+    """Split a resolution into header, WHEREAS, RESOLVED and EXPLANATION parts.
+
+    Stops at the first section that is missing or out of order, so the result
+    only has all four keys when the document follows the template's layout.
+    """
+    sections = {}
+    name, start = "header", 0
+    for next_name, pattern in _SECTION_ANCHORS:
+        match = pattern.search(text, start)
+        if match is None:
+            break
+        sections[name] = text[start:match.start()].strip()
+        name, start = next_name, match.start()
+    else:
+        sections[name] = text[start:].strip()
+    return sections
+
+def _usage_summary(usage: Optional[Dict]) -> Dict[str, int]:
+    # Flatten the API's usage block; cached_tokens is the part of the prompt
+    # served from OpenAI's prompt cache and billed at the discounted rate.
+    usage = usage or {}
+    details = usage.get("prompt_tokens_details") or {}
+    return {
+        "prompt_tokens": usage.get("prompt_tokens") or 0,
+        "cached_tokens": details.get("cached_tokens") or 0,
+        "completion_tokens": usage.get("completion_tokens") or 0
+    }
+
+def _sum_usage(usages) -> Dict[str, int]:
+    total = dict.fromkeys(_usage_summary(None), 0)
+    for usage in usages:
+        for key, value in usage.items():
+            total[key] += value
+    return total
+
+def _merge_reviews(reviews: List) -> Dict:
+    merged = {"template_violations": [], "formatting_violations": [], "overall_assessment": ""}
+    assessments = []
+    for name, review in reviews:
+        merged["template_violations"].extend(review["template_violations"])
+        merged["formatting_violations"].extend(review["formatting_violations"])
+        assessments.append(f"{_SECTION_TITLES[name]}: {review['overall_assessment']}")
+    merged["overall_assessment"] = "\n\n".join(assessments)
+    merged["_usage"] = _sum_usage(review.get("_usage", {}) for _, review in reviews)
+    return merged
+
+def _load_cached_review(text_hash: str) -> Optional[Dict]:
+    try:
+        with open(os.path.join(_CACHE_DIR, f"{text_hash}.json"), "rb") as f:
+            return orjson.loads(f.read())
+    except (OSError, orjson.JSONDecodeError):
+        return None
+
+def _store_cached_review(text_hash: str, result: Dict) -> None:
+    path = os.path.join(_CACHE_DIR, f"{text_hash}.json")
+    # Usage describes the API call that produced the result, not later cache hits.
+    result = {key: value for key, value in result.items() if key != "_usage"}
+    try:
+        os.makedirs(_CACHE_DIR, exist_ok=True)
+        # A private temp file per writer; sessions run in separate threads and
+        # may store the same document at once.
+        fd, tmp_path = tempfile.mkstemp(dir=_CACHE_DIR, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(orjson.dumps(result))
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+    except OSError as e:
+        logger.warning("could not write review cache %s: %s", path, e)
+
+class ResolutionReviewer:
+    def __init__(self, api_key: str):
+        self.api_key = api_key
+        self.client = OpenAI(api_key=api_key)
+        self.system_prompt = _SYSTEM_PROMPT
+
+    def read_document(self, source: Union[str, BinaryIO]) -> str:
+        """Extract the text of a .docx given its path or a binary file-like object."""
+        if isinstance(source, str):
+            return _read_docx(source, os.path.getmtime(source))
+        return _read_docx_upload(source)
+
+    def review_resolution(self, file_path: Optional[str] = None, text: Optional[str] = None) -> Dict:
+        resolution_text = self._resolve_text(file_path, text)
+        text_hash = content_hash(resolution_text)
+        result = _load_cached_review(text_hash)
+        if result is None:
+            result = self._do_review(resolution_text)
+            _store_cached_review(text_hash, result)
+        return result
+
+    async def areview_resolution(self, file_path: Optional[str] = None, text: Optional[str] = None,
+                                 aclient: Optional[AsyncOpenAI] = None,
+                                 semaphore: Optional[asyncio.Semaphore] = None) -> Dict:
+        if aclient is None:
+            # An AsyncOpenAI connection pool is bound to the event loop it first
+            # runs on, so the client is opened per call rather than in __init__.
+            async with AsyncOpenAI(api_key=self.api_key) as aclient:
+                return await self.areview_resolution(file_path, text, aclient, semaphore)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(_CONCURRENCY)
+        resolution_text = self._resolve_text(file_path, text)
+        text_hash = content_hash(resolution_text, mode="sections")
+        result = _load_cached_review(text_hash)
+        if result is None:
+            result = await self._areview_sections(aclient, semaphore, resolution_text)
+            _store_cached_review(text_hash, result)
+        return result
+
+    def review_batch(self, paths: List[str], concurrency: int = _CONCURRENCY) -> List[Dict]:
+        """Review several documents concurrently; results are returned in input order.
+
+        concurrency caps the API requests in flight across all documents and
+        their sections, not the number of documents.
         """
-        return ex_original, ex_modified, changes
-
-    def _build_user_prompt(self, ex_original, ex_modified, changes, resolution_text):
-        return f"""
-        Your task is to analyze a draft resolution for compliance with the template and rules. 
-        An example of a draft resolution is given below, and the suggested corrections. 
-        The incorrect resolution is given below, followed by the updated version of that resolution. 
-        The changes that were made and the rules violated are given after the updated version.
-        <EXAMPLE START>
-        ORIGINAL VERSION:-
-        {ex_original}
-        ----------------
-        MODIFIED VERSION:-
-        {ex_modified}
-        ----------------
-        ORIGINAL VERSION:-
-        {changes}
-        ----------------
-        <EXAMPLE END>
-        
-        Based on the template provided, alonside the rules that may or may not be violated, please analyze the following resolution for compliance with the template and rules:
-        {resolution_text}
-
-        Provide a detailed analysis identifying any violations of the template or rules.""" 
\ No newline at end of file
+        async def run():
+            semaphore = asyncio.Semaphore(concurrency)
+            async with AsyncOpenAI(api_key=self.api_key) as aclient:
+                return await asyncio.gather(*[
+                    self.areview_resolution(path, aclient=aclient, semaphore=semaphore) for path in paths
+                ])
+
+        return asyncio.run(run())
+
+    def submit_batch(self, paths: List[str]) -> str:
+        """Queue the documents as one OpenAI Batch API job and return its id."""
+        lines = []
+        for path in paths:
+            lines.append(orjson.dumps({
+                "custom_id": path,
+                "method": "POST",
+                "url": "/v1/chat/completions",
+                "body": self._completion_kwargs(self.read_document(path))
+            }))
+        batch_file = self.client.files.create(
+            file=("resolutions.jsonl", b"\n".join(lines)),
+            purpose="batch"
+        )
+        batch = self.client.batches.create(
+            input_file_id=batch_file.id,
+            endpoint="/v1/chat/completions",
+            completion_window="24h"
+        )
+        return batch.id
+
+    def poll_batch(self, batch_id: str, interval: float = 30.0) -> Dict[str, Dict]:
+        """Wait for a batch job to finish and return its results keyed by document path."""
+        batch = self.client.batches.retrieve(batch_id)
+        while batch.status not in ("completed", "failed", "expired", "cancelled"):
+            time.sleep(interval)
+            batch = self.client.batches.retrieve(batch_id)
+        if batch.status == "failed":
+            raise RuntimeError(f"Batch {batch_id} ended with status '{batch.status}'.")
+        results = {}
+        # Requests that failed are written to the error file, not the output file.
+        for file_id in (batch.output_file_id, batch.error_file_id):
+            for record in self._read_batch_file(file_id):
+                results[record["custom_id"]] = self._parse_batch_record(record)
+        if batch.status != "completed":
+            # An expired or cancelled batch keeps whatever finished; mark the rest.
+            for record in self._read_batch_file(batch.input_file_id):
+                results.setdefault(record["custom_id"], {
+                    "error": {"message": f"Batch {batch.status} before this request finished."}
+                })
+        return results
+
+    def _read_batch_file(self, file_id: Optional[str]) -> List[Dict]:
+        if not file_id:
+            return []
+        return [orjson.loads(line) for line in self.client.files.content(file_id).text.splitlines() if line]
+
+    def _resolve_text(self, file_path: Optional[str], text: Optional[str]) -> str:
+        if text is None:
+            if file_path is None:
+                raise ValueError("Either file_path or text must be provided.")
+            text = self.read_document(file_path)
+        return text
+
+    def _do_review(self, resolution_text: str) -> Dict:
+        response = self.client.chat.completions.create(**self._completion_kwargs(resolution_text))
+        truncated = None
+        if response.choices[0].finish_reason == "length":
+            truncated = response
+            response = self.client.chat.completions.create(
+                **self._completion_kwargs(resolution_text, max_tokens=_RETRY_MAX_TOKENS)
+            )
+        return self._parse_response(response, truncated)
+
+    async def _ado_review(self, aclient: AsyncOpenAI, semaphore: asyncio.Semaphore,
+                          resolution_text: str, section: Optional[str] = None) -> Dict:
+        async with semaphore:
+            response = await aclient.chat.completions.create(**self._completion_kwargs(resolution_text, section=section))
+        truncated = None
+        if response.choices[0].finish_reason == "length":
+            truncated = response
+            async with semaphore:
+                response = await aclient.chat.completions.create(
+                    **self._completion_kwargs(resolution_text, max_tokens=_RETRY_MAX_TOKENS, section=section)
+                )
+        return self._parse_response(response, truncated)
+
+    async def _areview_sections(self, aclient: AsyncOpenAI, semaphore: asyncio.Semaphore,
+                                resolution_text: str) -> Dict:
+        sections = _split_sections(resolution_text)
+        if len(sections) < len(_SECTION_PROMPTS):
+            # Missing or misordered sections can only be judged against the whole document.
+            return await self._ado_review(aclient, semaphore, resolution_text)
+
+        async def review(name, body):
+            return name, await self._ado_review(aclient, semaphore, body, section=name)
+
+        return _merge_reviews(await asyncio.gather(*[review(name, body) for name, body in sections.items()]))
+
+    def _completion_kwargs(self, resolution_text: str, max_tokens: int = _MAX_TOKENS,
+                           section: Optional[str] = None) -> Dict:
+        if section is None:
+            system_prompt, user_prompt = self.system_prompt, _USER_PROMPT_PREFIX + resolution_text
+        else:
+            # Section reviews skip the few-shot example, which covers the whole document.
+            system_prompt, user_prompt = _SECTION_PROMPTS[section], "ANALYZE:\n" + resolution_text
+        return dict(
+            model=_MODEL,
+            messages=[
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": user_prompt}
+            ],
+            response_format={
+                "type": "json_schema",
+                "json_schema": {"name": "review", "schema": _REVIEW_SCHEMA, "strict": True}
+            },
+            temperature=0,
+            top_p=1,
+            max_tokens=max_tokens,
+            seed=0
+        )
+
+    def _parse_batch_record(self, record: Dict) -> Dict:
+        # A bad item is reported under "error" so it cannot abort the rest of the batch.
+        if record.get("error"):
+            return {"error": record["error"]}
+        response = record.get("response") or {}
+        body = response.get("body") or {}
+        if response.get("status_code") != 200:
+            return {"error": body.get("error") or {"message": f"Request failed with status {response.get('status_code')}."}}
+        choice = body["choices"][0]
+        if choice.get("finish_reason") == "length":
+            return {"error": {"message": "Response was truncated at the completion token limit."}}
+        if choice["message"].get("refusal"):
+            return {"error": {"message": f"The model refused to review the resolution: {choice['message']['refusal']}"}}
+        try:
+            parsed = orjson.loads(choice["message"]["content"])
+        except (TypeError, orjson.JSONDecodeError) as e:
+            return {"error": {"message": f"Could not parse response: {e}"}}
+        return {**parsed, "_usage": _usage_summary(body.get("usage"))}
+
+    def _parse_response(self, response, truncated=None) -> Dict:
+        # truncated is the cut-off first attempt, if any; its tokens were billed too.
+        logger.debug("response content: %s", response.choices[0].message.content)
+        if response.choices[0].finish_reason == "length":
+            # Only reached once the higher-cap retry was cut off as well.
+            raise RuntimeError("The review response was truncated at the completion token limit.")
+        refusal = getattr(response.choices[0].message, "refusal", None)
+        if refusal:
+            # With a strict schema, a refusal comes back with content=None.
+            raise RuntimeError(f"The model refused to review the resolution: {refusal}")
+        usage = _sum_usage(
+            _usage_summary(r.usage.model_dump() if r.usage is not None else None)
+            for r in (truncated, response) if r is not None
+        )
+        return {**orjson.loads(response.choices[0].message.content), "_usage": usage}